@@ -0,0 +1,207 @@
+import json
+import math
+import os
+import wave
+from array import array
+from pathlib import Path
+
+import pytest
+
+from tmplayer import loudness
+from tmplayer.loudness import (
+    CACHE_VERSION,
+    MAX_GAIN,
+    MIN_GAIN,
+    REFERENCE_LOUDNESS,
+    SAMPLE_RATE,
+    LoudnessAnalyzer,
+    gain_to_volume,
+    histogram_gain,
+    merge_histograms,
+    volume_headroom,
+    wav_histogram,
+)
+
+
+def write_sine(path: Path, amplitude: float, seconds: float = 1.0) -> None:
+    """Write a stereo 1kHz sine at the given amplitude in dBFS."""
+    peak = 32767 * 10 ** (amplitude / 20)
+    frames = round(SAMPLE_RATE * seconds)
+    samples = array("h")
+    for i in range(frames):
+        value = round(peak * math.sin(2 * math.pi * 1000 * i / SAMPLE_RATE))
+        samples.extend((value, value))
+    with wave.open(path.as_posix(), "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(samples.tobytes())
+
+
+def test_histogram_gain_uses_95th_percentile() -> None:
+    # 95 quiet blocks at 60dB and 5 loud blocks at 70dB
+    histogram = {600: 95, 700: 5}
+    assert histogram_gain(histogram) == pytest.approx(REFERENCE_LOUDNESS - 70)
+    histogram = {600: 96, 700: 4}
+    assert histogram_gain(histogram) == pytest.approx(REFERENCE_LOUDNESS - 60)
+
+
+def test_histogram_gain_clamps() -> None:
+    assert histogram_gain({0: 10}) == MAX_GAIN
+    assert histogram_gain({1000: 10}) == MIN_GAIN
+    assert histogram_gain({}) is None
+
+
+def test_gain_to_volume_is_cubic() -> None:
+    assert gain_to_volume(50, 0) == 50
+    # libvlc volume is cubic, so -6dB of amplitude is only 2dB of volume
+    assert gain_to_volume(100, -6) == round(100 * 10 ** (-6 / 60))
+    assert (gain_to_volume(80, -18) / 80) ** 3 == pytest.approx(
+        10 ** (-18 / 20), rel=0.05
+    )
+
+
+def test_volume_headroom() -> None:
+    assert volume_headroom(100) == 0
+    assert gain_to_volume(50, volume_headroom(50)) == 100
+    assert volume_headroom(0) == 0
+
+
+def test_merge_histograms() -> None:
+    merged = merge_histograms([{1: 2, 3: 4}, {3: 1, 5: 6}])
+    assert merged == {1: 2, 3: 5, 5: 6}
+
+
+def test_wav_histogram_tracks_level(tmp_path: Path) -> None:
+    quiet, loud = tmp_path / "quiet.wav", tmp_path / "loud.wav"
+    write_sine(quiet, -18)
+    write_sine(loud, -6)
+    quiet_gain = histogram_gain(wav_histogram(quiet))
+    loud_gain = histogram_gain(wav_histogram(loud))
+    assert quiet_gain is not None and loud_gain is not None
+    assert quiet_gain - loud_gain == pytest.approx(12, abs=0.2)
+
+
+def test_wav_histogram_rejects_other_formats(tmp_path: Path) -> None:
+    path = tmp_path / "mono.wav"
+    with wave.open(path.as_posix(), "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(b"\0\0" * 100)
+    with pytest.raises(ValueError):
+        wav_histogram(path)
+
+
+def make_tracks(tmp_path: Path, *names: str) -> list[Path]:
+    paths = []
+    for name in names:
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"")
+        paths.append(path.resolve())
+    return paths
+
+
+def test_cache_round_trip(tmp_path: Path) -> None:
+    (track,) = make_tracks(tmp_path, "a.mp3")
+    cache_file = tmp_path / "cache" / "loudness.json"
+    analyzer = LoudnessAnalyzer([track], cache_file)
+    analyzer.cache[track.as_posix()] = {
+        "mtime": track.stat().st_mtime,
+        "histogram": {600: 10},
+    }
+    analyzer.save_cache()
+
+    analyzer = LoudnessAnalyzer([track], cache_file)
+    assert analyzer.is_cached(track)
+    assert analyzer.track_gain(track) == pytest.approx(
+        REFERENCE_LOUDNESS - 60
+    )
+
+
+def test_save_cache_leaves_no_temp_files(tmp_path: Path) -> None:
+    cache_file = tmp_path / "loudness.json"
+    analyzer = LoudnessAnalyzer([], cache_file)
+    analyzer.cache["x"] = {"mtime": 1.0, "histogram": None}
+    analyzer.save_cache()
+    analyzer.save_cache()
+    assert list(tmp_path.iterdir()) == [cache_file]
+
+
+def test_cache_skips_malformed_entries(tmp_path: Path) -> None:
+    cache_file = tmp_path / "loudness.json"
+    tracks = {
+        "no-histogram": {"mtime": 1},
+        "bad-histogram": {"mtime": 1, "histogram": [1, 2]},
+        "not-a-dict": 5,
+        "good": {"mtime": 1, "histogram": {"600": 10}},
+    }
+    cache_file.write_text(
+        json.dumps({"version": CACHE_VERSION, "tracks": tracks})
+    )
+    analyzer = LoudnessAnalyzer([], cache_file)
+    assert list(analyzer.cache) == ["good"]
+    assert analyzer.cache["good"]["histogram"] == {600: 10}
+
+
+def test_stale_entries_are_ignored(tmp_path: Path) -> None:
+    (track,) = make_tracks(tmp_path, "a.mp3")
+    analyzer = LoudnessAnalyzer([track], tmp_path / "loudness.json")
+    analyzer.cache[track.as_posix()] = {
+        "mtime": track.stat().st_mtime,
+        "histogram": {600: 10},
+    }
+    assert analyzer.track_gain(track) is not None
+    mtime = track.stat().st_mtime + 10
+    os.utime(track, (mtime, mtime))
+    assert not analyzer.is_cached(track)
+    assert analyzer.track_gain(track) is None
+
+
+def test_album_gain(tmp_path: Path) -> None:
+    a, b, broken, other = make_tracks(
+        tmp_path, "album/a.mp3", "album/b.mp3", "album/c.mp3", "other/d.mp3"
+    )
+    analyzer = LoudnessAnalyzer([a, b, broken, other], tmp_path / "c.json")
+
+    def store(path: Path, histogram: dict[int, int] | None) -> None:
+        analyzer.cache[path.as_posix()] = {
+            "mtime": path.stat().st_mtime,
+            "histogram": histogram,
+        }
+
+    store(a, {500: 20})
+    assert analyzer.album_gain(a) is None
+
+    store(b, {700: 20})
+    store(broken, None)
+    assert analyzer.track_gain(broken) is None
+    # the failed track is left out of the album
+    assert analyzer.album_gain(a) == pytest.approx(REFERENCE_LOUDNESS - 70)
+    assert analyzer.album_gain(other) is None
+
+
+def test_pending_starts_with_current_album(tmp_path: Path) -> None:
+    a1, b1, b2, b3, c1 = make_tracks(
+        tmp_path, "a/1.mp3", "b/1.mp3", "b/2.mp3", "b/3.mp3", "c/1.mp3"
+    )
+    analyzer = LoudnessAnalyzer([a1, b1, b2, b3, c1], tmp_path / "c.json")
+    assert analyzer.get_pending(b2) == [b2, b1, b3, a1, c1]
+    assert analyzer.get_pending() == [a1, b1, b2, b3, c1]
+
+
+def test_failed_start_is_reported(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    class Context:
+        def Pool(self, *args: object, **kwargs: object) -> None:
+            raise OSError("Too many open files")
+
+    monkeypatch.setattr(
+        loudness.multiprocessing, "get_context", lambda _: Context()
+    )
+    (track,) = make_tracks(tmp_path, "a.mp3")
+    analyzer = LoudnessAnalyzer([track], tmp_path / "c.json")
+    analyzer.run([track])
+    assert analyzer.get_progress().failed
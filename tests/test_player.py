@@ -0,0 +1,37 @@
+import math
+
+import pytest
+
+pytest.importorskip("vlc")
+
+from tmplayer.player import Player
+
+
+def make_player(volume: int, gain: float | None) -> Player:
+    player = Player.__new__(Player)
+    player.volume = volume
+    player.gain = gain
+    return player
+
+
+def test_effective_volume_without_gain() -> None:
+    assert make_player(50, None).get_effective_volume() == 50
+
+
+def test_effective_volume_is_cubic() -> None:
+    # -6dB of amplitude is -2dB on the cubic libvlc volume
+    player = make_player(80, -6)
+    assert player.get_applied_gain() == -6
+    assert player.get_effective_volume() == round(80 * 10 ** (-6 / 60))
+
+
+def test_positive_gain_is_capped_at_volume_100() -> None:
+    player = make_player(50, 12)
+    assert player.get_applied_gain() == 12
+    assert player.get_effective_volume() == round(50 * 10 ** (12 / 60))
+    player = make_player(80, 12)
+    assert player.get_applied_gain() == pytest.approx(60 * math.log10(1.25))
+    assert player.get_effective_volume() == 100
+    player = make_player(100, 3)
+    assert player.get_applied_gain() == 0
+    assert player.get_effective_volume() == 100
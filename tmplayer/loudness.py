@@ -0,0 +1,434 @@
+import json
+import logging
+import math
+import multiprocessing
+import os
+import tempfile
+import wave
+from array import array
+from dataclasses import dataclass
+from operator import mul
+from pathlib import Path
+from threading import Lock, Thread
+from time import monotonic, sleep
+from typing import Any, Sequence
+
+LOGGER = logging.getLogger(__name__)
+
+CACHE_DIR = (
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+    / "tmplayer"
+)
+CACHE_FILE = CACHE_DIR / "loudness.json"
+CACHE_VERSION = 2
+
+# ReplayGain reference level for equal-loudness filtered 16-bit samples,
+# in dB. Only valid together with the filters below.
+REFERENCE_LOUDNESS = 64.82
+RMS_PERCENTILE = 95
+BLOCK_SECONDS = 0.05
+BIN_RESOLUTION = 10  # histogram bins per dB
+SAMPLE_RATE = 22050
+MIN_GAIN = -24.0
+MAX_GAIN = 12.0
+SAVE_EVERY = 10
+# Give up on a decode after this long, plus the length of the track.
+DECODE_TIMEOUT = 60.0
+
+# Equal-loudness filter coefficients for SAMPLE_RATE, taken from the
+# ReplayGain reference implementation: a 10th order Yule-Walker filter
+# followed by a 2nd order Butterworth high-pass filter at 150Hz.
+YULE_A = (
+    1.0,
+    -1.49858979367799,
+    0.87350271418188,
+    0.12205022308084,
+    -0.80774944671438,
+    0.47854794562326,
+    -0.12453458140019,
+    -0.04067510197014,
+    0.08333755284107,
+    -0.04237348025746,
+    0.02977207319925,
+)
+YULE_B = (
+    0.33642304856132,
+    -0.25572241425570,
+    -0.11828570177555,
+    0.11921148675203,
+    -0.07834489609479,
+    -0.00469977914380,
+    -0.00589500224440,
+    0.05724228140351,
+    0.00832043980773,
+    -0.01635381384540,
+    -0.01760176568150,
+)
+BUTTER_A = (1.0, -1.93957020735167, 0.94134329944165)
+BUTTER_B = (0.97022837669833, -1.94045675339666, 0.97022837669833)
+
+Histogram = dict[int, int]
+
+
+@dataclass
+class LoudnessProgress:
+    done: int
+    total: int
+    failed: bool
+
+
+def gain_to_volume(volume: int, gain: float) -> int:
+    """Scale a libvlc volume by a gain in dB. The libvlc volume is
+    cubic, i.e. the amplitude is (volume / 100) ** 3."""
+    return round(volume * 10 ** (gain / 60))
+
+
+def volume_headroom(volume: int) -> float:
+    """Get the largest gain in dB which keeps the volume under 100,
+    since anything above it amplifies in software and clips."""
+    return 60 * math.log10(100 / volume) if volume > 0 else 0.0
+
+
+class IIRFilter:
+    """A direct form I IIR filter keeping its state between blocks."""
+
+    def __init__(self, b: Sequence[float], a: Sequence[float]):
+        self.b = b
+        self.a = a
+        self.order = len(a) - 1
+        self.x_hist = [0.0] * self.order
+        self.y_hist = [0.0] * self.order
+
+    def process(self, samples: Sequence[float]) -> list[float]:
+        b, a, order = self.b, self.a, self.order
+        xs = self.x_hist + list(samples)
+        ys = self.y_hist + [0.0] * len(samples)
+        for n in range(order, len(xs)):
+            acc = b[0] * xs[n]
+            for k in range(1, order + 1):
+                acc += b[k] * xs[n - k] - a[k] * ys[n - k]
+            ys[n] = acc
+        self.x_hist = xs[-order:]
+        self.y_hist = ys[-order:]
+        return ys[order:]
+
+
+class EqualLoudnessFilter:
+    """Weight a single channel by the inverse of the equal-loudness
+    contour, so bass-heavy tracks are not measured as too loud."""
+
+    def __init__(self) -> None:
+        self.yule = IIRFilter(YULE_B, YULE_A)
+        self.butter = IIRFilter(BUTTER_B, BUTTER_A)
+
+    def process(self, samples: Sequence[float]) -> list[float]:
+        return self.butter.process(self.yule.process(samples))
+
+
+# libvlc instance of a worker process, reused for every track.
+worker_instance: Any = None
+
+
+def lower_priority() -> None:
+    """Run worker processes at the lowest scheduling priority."""
+    try:
+        os.nice(19)
+    except (AttributeError, OSError):
+        pass
+
+
+def init_worker() -> None:
+    """Set up a worker process. vlc is imported here, so the rest of
+    the module works without libvlc."""
+    global worker_instance
+    lower_priority()
+    import vlc
+
+    worker_instance = vlc.Instance("--no-video", "--quiet")
+    if worker_instance is not None:
+        worker_instance.log_unset()
+
+
+def decode_to_wav(path: Path, dst: Path) -> bool:
+    """Decode an audio file to a 16-bit PCM wav file with libvlc."""
+    import vlc
+
+    instance = worker_instance
+    if instance is None:
+        return False
+    media = instance.media_new(path.as_posix())
+    media.add_option(
+        ":sout=#transcode{vcodec=none,acodec=s16l,channels=2,"
+        f"samplerate={SAMPLE_RATE}}}"
+        f":std{{access=file,mux=wav,dst={dst.as_posix()}}}"
+    )
+    player = instance.media_player_new()
+    player.set_media(media)
+    player.play()
+    start = monotonic()
+    try:
+        while player.get_state() not in (
+            vlc.State.Ended,
+            vlc.State.Stopped,
+            vlc.State.Error,
+        ):
+            timeout = DECODE_TIMEOUT + max(player.get_length(), 0) / 1000
+            if monotonic() - start > timeout:
+                player.stop()
+                return False
+            sleep(0.1)
+        return player.get_state() != vlc.State.Error  # type: ignore
+    finally:
+        player.release()
+
+
+def wav_histogram(path: Path) -> Histogram:
+    """Build a histogram of the equal-loudness filtered
+    RMS loudness of 50ms blocks."""
+    histogram: Histogram = {}
+    with wave.open(path.as_posix(), "rb") as wav:
+        if (
+            wav.getsampwidth() != 2
+            or wav.getnchannels() != 2
+            or wav.getframerate() != SAMPLE_RATE
+        ):
+            raise ValueError(f"Unsupported wav format in {path}")
+        filters = (EqualLoudnessFilter(), EqualLoudnessFilter())
+        block_frames = round(SAMPLE_RATE * BLOCK_SECONDS)
+        while True:
+            samples = array("h", wav.readframes(block_frames))
+            if len(samples) == 0:
+                break
+            square_sum = 0.0
+            for channel, flt in enumerate(filters):
+                filtered = flt.process(samples[channel::2])
+                square_sum += sum(map(mul, filtered, filtered))
+            mean_square = square_sum / len(samples)
+            db = 10 * math.log10(mean_square + 1e-10)
+            key = round(db * BIN_RESOLUTION)
+            histogram[key] = histogram.get(key, 0) + 1
+    return histogram
+
+
+def analyze_track(path: str) -> tuple[str, float, Histogram | None]:
+    """Decode a single track and return its loudness histogram,
+    or None if it could not be analyzed. Runs inside a worker process,
+    so it never raises."""
+    mtime = 0.0
+    tmp = None
+    try:
+        pth = Path(path)
+        mtime = pth.stat().st_mtime
+        fd, tmp = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        if not decode_to_wav(pth, Path(tmp)):
+            return path, mtime, None
+        return path, mtime, wav_histogram(Path(tmp))
+    except Exception:
+        return path, mtime, None
+    finally:
+        if tmp is not None:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+
+
+def histogram_gain(histogram: Histogram) -> float | None:
+    """Compute the ReplayGain adjustment in dB from a histogram.
+    The loudness is the block value at the 95th percentile."""
+    total = sum(histogram.values())
+    if total == 0:
+        return None
+    threshold = math.ceil(total * (100 - RMS_PERCENTILE) / 100)
+    seen = 0
+    for key in sorted(histogram, reverse=True):
+        seen += histogram[key]
+        if seen >= threshold:
+            gain = REFERENCE_LOUDNESS - key / BIN_RESOLUTION
+            return min(max(gain, MIN_GAIN), MAX_GAIN)
+    return None
+
+
+def merge_histograms(histograms: list[Histogram]) -> Histogram:
+    merged: Histogram = {}
+    for histogram in histograms:
+        for key, count in histogram.items():
+            merged[key] = merged.get(key, 0) + count
+    return merged
+
+
+def parse_cache_entry(entry: Any) -> dict[str, Any] | None:
+    """Validate a cache entry read from disk, None if it is malformed.
+    A None histogram marks a track that could not be analyzed."""
+    try:
+        mtime = float(entry["mtime"])
+        raw = entry["histogram"]
+        histogram = (
+            None
+            if raw is None
+            else {int(k): int(v) for k, v in raw.items()}
+        )
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return None
+    return {"mtime": mtime, "histogram": histogram}
+
+
+class LoudnessAnalyzer:
+    """Analyze track loudness in a background process pool
+    and cache the results on disk, keyed by path and mtime."""
+
+    paths: list[Path]
+    cache_file: Path
+    cache: dict[str, dict[str, Any]]
+    lock: Lock
+    pool: Any
+    done: int
+    total: int
+    failed: bool
+
+    def __init__(self, paths: list[Path], cache_file: Path = CACHE_FILE):
+        self.paths = [p.resolve() for p in paths]
+        self.cache_file = cache_file
+        self.cache = self.load_cache()
+        self.lock = Lock()
+        self.pool = None
+        self.done = 0
+        self.total = 0
+        self.failed = False
+
+    def load_cache(self) -> dict[str, dict[str, Any]]:
+        try:
+            with open(self.cache_file, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or data.get("version") != CACHE_VERSION:
+            return {}
+        tracks = data.get("tracks")
+        if not isinstance(tracks, dict):
+            return {}
+        cache = {}
+        for path, raw in tracks.items():
+            entry = parse_cache_entry(raw)
+            if entry is not None:
+                cache[path] = entry
+        return cache
+
+    def save_cache(self) -> None:
+        with self.lock:
+            data = {"version": CACHE_VERSION, "tracks": dict(self.cache)}
+            tmp = None
+            try:
+                self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+                with tempfile.NamedTemporaryFile(
+                    "w",
+                    encoding="utf-8",
+                    dir=self.cache_file.parent,
+                    suffix=".tmp",
+                    delete=False,
+                ) as f:
+                    tmp = f.name
+                    json.dump(data, f)
+                os.replace(tmp, self.cache_file)
+            except OSError:
+                LOGGER.warning("Could not write %s", self.cache_file)
+                if tmp is not None and os.path.exists(tmp):
+                    os.unlink(tmp)
+
+    def get_entry(self, path: Path) -> dict[str, Any] | None:
+        """Get the cache entry of path, None if missing or stale."""
+        entry = self.cache.get(path.as_posix())
+        try:
+            if entry is not None and entry["mtime"] == path.stat().st_mtime:
+                return entry
+        except OSError:
+            pass
+        return None
+
+    def is_cached(self, path: Path) -> bool:
+        return self.get_entry(path) is not None
+
+    def get_pending(self, current: Path | None = None) -> list[Path]:
+        """Get the tracks to analyze. The current track goes first,
+        then the rest of its album, then the rest in playlist order."""
+        pending = [p for p in self.paths if not self.is_cached(p)]
+        if current is None:
+            return pending
+        current = current.resolve()
+        return sorted(
+            pending, key=lambda p: (p != current, p.parent != current.parent)
+        )
+
+    def start(self, current: Path | None = None) -> None:
+        """Start the analysis in a separate thread."""
+        pending = self.get_pending(current)
+        self.total = len(pending)
+        if self.total == 0:
+            return
+        Thread(target=self.run, args=(pending,), daemon=True).start()
+
+    def run(self, pending: list[Path]) -> None:
+        # spawn, since forking a process running libvlc threads is unsafe.
+        # Leave a core for the playback thread.
+        ctx = multiprocessing.get_context("spawn")
+        workers = max(1, min(4, (os.cpu_count() or 1) - 1))
+        try:
+            self.pool = ctx.Pool(workers, initializer=init_worker)
+            results = self.pool.imap_unordered(
+                analyze_track, [p.as_posix() for p in pending]
+            )
+        except Exception as e:
+            LOGGER.warning("Could not start loudness analysis: %s", e)
+            self.failed = True
+            if self.pool is not None:
+                self.pool.terminate()
+            return
+        while True:
+            try:
+                path, mtime, histogram = next(results)
+            except StopIteration:
+                break
+            except Exception:
+                LOGGER.debug("Loudness analysis failed", exc_info=True)
+            else:
+                if histogram is None:
+                    LOGGER.debug("Could not analyze %s", path)
+                with self.lock:
+                    self.cache[path] = {"mtime": mtime, "histogram": histogram}
+            self.done += 1
+            if self.done % SAVE_EVERY == 0:
+                self.save_cache()
+        self.pool.close()
+        self.save_cache()
+
+    def stop(self) -> None:
+        if self.pool is not None:
+            self.pool.terminate()
+        if self.done > 0:
+            self.save_cache()
+
+    def get_progress(self) -> LoudnessProgress:
+        return LoudnessProgress(self.done, self.total, self.failed)
+
+    def track_gain(self, path: Path) -> float | None:
+        entry = self.get_entry(path.resolve())
+        if entry is None or entry["histogram"] is None:
+            return None
+        return histogram_gain(entry["histogram"])
+
+    def album_gain(self, path: Path) -> float | None:
+        """Compute the gain of the album, i.e. all the tracks sharing
+        the directory of path. None until every track is analyzed.
+        Tracks that could not be analyzed are left out."""
+        album = path.resolve().parent
+        histograms = []
+        for pth in self.paths:
+            if pth.parent != album:
+                continue
+            entry = self.get_entry(pth)
+            if entry is None:
+                return None
+            if entry["histogram"] is not None:
+                histograms.append(entry["histogram"])
+        return histogram_gain(merge_histograms(histograms))
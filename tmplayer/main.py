@@ -19,6 +19,12 @@ def parse_args(argv: Sequence[str] | None = None) -> argparse.Namespace:
         action="version",
         version=__version__,
     )
+    parser.add_argument(
+        "--replaygain",
+        choices=("off", "track", "album"),
+        default="track",
+        help="Normalize loudness per track or per album (default: track).",
+    )
     parser.add_argument(
         "paths",
         metavar="PATH",
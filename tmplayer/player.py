@@ -9,6 +9,12 @@ from time import sleep
 
 import vlc
 
+from tmplayer.loudness import (
+    LoudnessAnalyzer,
+    gain_to_volume,
+    volume_headroom,
+)
+
 LOGGER = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
@@ -52,6 +58,9 @@ class Player:
     random_mode: bool
     loop_mode: bool
     repeat_mode: bool
+    replaygain: str
+    gain: float | None
+    analyzer: LoudnessAnalyzer | None
 
     def __init__(self, args: argparse.Namespace):
         # disable error output
@@ -74,8 +83,15 @@ class Player:
         self.curr_video_idx = 0
         self.volume = 50
         self.volume_step = 5
+        self.replaygain = args.replaygain
+        self.gain = None
+        self.analyzer = (
+            LoudnessAnalyzer([video.path for video in self.videos])
+            if self.replaygain != "off"
+            else None
+        )
         self.player = vlc.MediaPlayer()
-        self.player.audio_set_volume(self.volume)
+        self.player.audio_set_volume(self.get_effective_volume())
         self.random_mode = False
         self.loop_mode = False
         self.repeat_mode = False
@@ -153,6 +169,32 @@ class Player:
             self.videos[self.curr_video_idx].path.as_posix()
         )
         self.player.set_media(media)
+        self.gain = self.get_gain()
+        self.player.audio_set_volume(self.get_effective_volume())
+
+    def get_gain(self) -> float | None:
+        """Get the ReplayGain adjustment in dB for the current song,
+        None if it is not analyzed yet. In album mode there is no
+        fallback to the track gain, so an album is never played with
+        a mix of both."""
+        if self.analyzer is None:
+            return None
+        path = self.videos[self.curr_video_idx].path
+        if self.replaygain == "album":
+            return self.analyzer.album_gain(path)
+        return self.analyzer.track_gain(path)
+
+    def get_applied_gain(self) -> float:
+        """Get the gain actually applied, limited to what fits
+        under volume 100."""
+        if self.gain is None:
+            return 0.0
+        return min(self.gain, volume_headroom(self.volume))
+
+    def get_effective_volume(self) -> int:
+        """Get the volume scaled by the ReplayGain adjustment."""
+        volume = gain_to_volume(self.volume, self.get_applied_gain())
+        return min(max(volume, 0), 100)
 
     def wait_for_open(self) -> None:
         """Wait for the player to open."""
@@ -205,12 +247,12 @@ class Player:
     def volume_up(self) -> None:
         if self.player is not None and self.volume < 100:
             self.volume += self.volume_step
-            self.player.audio_set_volume(self.volume)
+            self.player.audio_set_volume(self.get_effective_volume())
 
     def volume_down(self) -> None:
         if self.player is not None and self.volume > 0:
             self.volume -= self.volume_step
-            self.player.audio_set_volume(self.volume)
+            self.player.audio_set_volume(self.get_effective_volume())
 
     def change_player_state(self) -> None:
         if self.player is not None and self.player.get_state() in (
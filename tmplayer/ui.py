@@ -50,6 +50,7 @@ class PlayerUI:
     playlistbox: PlaylistBox
     pb: progressBar
     pb_text: urwid.Text
+    gain_text: urwid.Text
 
     def __init__(self, args: argparse.Namespace):
         self.border = ("╔", "═", "║", "╗", "╚", "║", "═", "╝")
@@ -146,15 +147,24 @@ class PlayerUI:
         self.pb = progressBar("reversed", "highlight")
         self.pb.set_completion(0)
         self.pb_text = urwid.Text("", "right")
-        footer = urwid.Columns([self.pb, (18, self.pb_text)])
+        self.gain_text = urwid.Text("", "right")
+        footer = urwid.Columns(
+            [self.pb, (18, self.pb_text), (24, self.gain_text)]
+        )
         return footer
 
     def start_playing(self) -> None:
         """Start playing the music in a separate thread."""
         Thread(target=self.music_player.play, daemon=True).start()
+        if self.music_player.analyzer is not None:
+            self.music_player.analyzer.start(
+                self.music_player.videos[self.music_player.curr_video_idx].path
+            )
 
     def handle_keys(self, key: str) -> None:
         if key in ("q", "Q"):
+            if self.music_player.analyzer is not None:
+                self.music_player.analyzer.stop()
             raise urwid.ExitMainLoop
         try:
             self.key_dict[key]()
@@ -315,11 +325,27 @@ class PlayerUI:
             self.start = 0
         loop.set_alarm_in(0.5, self.update_song_title)
 
+    def update_gain_text(self) -> None:
+        """Show the progress of the loudness analysis."""
+        if self.music_player.analyzer is None:
+            return
+        progress = self.music_player.analyzer.get_progress()
+        if progress.failed:
+            text = "Analysis failed"
+        elif progress.done < progress.total:
+            text = f"Analyzing: {progress.done}/{progress.total}"
+        elif self.music_player.gain is None:
+            text = "Gain: n/a"
+        else:
+            text = f"Gain: {self.music_player.get_applied_gain():+.1f} dB"
+        self.gain_text.set_text(text)
+
     def _main(self, loop: urwid.MainLoop, _: Any) -> None:
         td = self.music_player.get_time_details()
         self.pb.set_completion(td.percentage)
         self.time_text.set_text(f"{td.curr_time}/{td.duration}")
         self.pb_text.set_text(f"{td.curr_time}/{td.duration}")
+        self.update_gain_text()
 
         if self.music_player.prev_video_idx is not None:
             self.list[self.music_player.prev_video_idx].set_attr_map(